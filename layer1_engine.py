@@ -7,14 +7,20 @@ CPU-only, no GPU required.
 """
 
 import os
+import functools
+import itertools
 from llama_cpp import Llama
 
 MODEL_DIR = "models"
 MODEL_FILE = "Llama-3.2-1B-Instruct-Q4_K_M.gguf"
+N_THREADS  = os.cpu_count() or 4
+TOKEN_CACHE_SIZE = 64   # Tokenized prompt pieces kept in memory
+STOP_SEQUENCES = ["<|eot_id|>", "[INST]", "User:", "You:"]
 
 class LLMEngine:
     def __init__(self):
         self.model = None
+        self.tokenize_cached = functools.lru_cache(maxsize=TOKEN_CACHE_SIZE)(self._tokenize)
         self._load_model()
 
     def _load_model(self):
@@ -28,15 +34,41 @@ class LLMEngine:
         print(f"[Layer 1] Loading model from {model_path} ...")
         self.model = Llama(
             model_path=model_path,
-            n_ctx=2048,        # Strict context window limit to prevent RAM explosion
-            n_threads=4,       # CPU threads
-            n_gpu_layers=0,    # CPU only
+            n_ctx=2048,                # Strict context window limit to prevent RAM explosion
+            n_threads=N_THREADS,       # CPU threads for token generation
+            n_threads_batch=N_THREADS, # CPU threads for prompt processing
+            n_batch=512,               # Prompt tokens evaluated per batch
+            n_gpu_layers=0,            # CPU only
+            use_mmap=True,             # Page weights in from the .gguf on demand
+            use_mlock=False,
+            flash_attn=True,           # Fused attention kernel, also on CPU
             verbose=False
         )
         print("[Layer 1] Model loaded successfully.")
 
-    def generate(self, prompt: str, max_tokens: int = 512, temperature: float = 0.2, stream: bool = True):
-        """Stream or return the LLM output for the given prompt."""
+    def _tokenize(self, text: str) -> tuple:
+        """Tokenize a prompt piece (special tokens parsed, no BOS)."""
+        return tuple(self.model.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+
+    def _tokens_from_parts(self, parts: list) -> list:
+        """BOS followed by the (cached) tokens of every prompt piece."""
+        tokens = [self.model.token_bos()]
+        tokens.extend(itertools.chain.from_iterable(self.tokenize_cached(p) for p in parts))
+        return tokens
+
+    def count_tokens(self, parts: list) -> int:
+        """Exact prompt length in tokens, including BOS."""
+        return len(self._tokens_from_parts(parts))
+
+    def generate_from_parts(self, parts: list, max_tokens: int = 512, temperature: float = 0.2, stream: bool = True):
+        """
+        Like generate(), but for a prompt given as pieces (see assemble_prompt_parts).
+        Identical pieces are tokenized once and reused from the cache.
+        """
+        yield from self.generate(self._tokens_from_parts(parts), max_tokens, temperature, stream)
+
+    def generate(self, prompt, max_tokens: int = 512, temperature: float = 0.2, stream: bool = True):
+        """Stream or return the LLM output for the given prompt (text or token ids)."""
         if stream:
             output = self.model(
                 prompt,
@@ -44,7 +76,7 @@ class LLMEngine:
                 temperature=temperature,
                 stream=True,
                 echo=False,
-                stop=["<|eot_id|>", "[INST]", "User:", "You:"]
+                stop=STOP_SEQUENCES
             )
             for chunk in output:
                 token = chunk["choices"][0]["text"]
@@ -55,6 +87,6 @@ class LLMEngine:
                 max_tokens=max_tokens,
                 temperature=temperature,
                 echo=False,
-                stop=["<|eot_id|>", "[INST]", "User:", "You:"]
+                stop=STOP_SEQUENCES
             )
             yield output["choices"][0]["text"]
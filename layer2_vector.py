@@ -2,48 +2,179 @@
 LAYER 2: Vector Brain (FAISS + MiniLM)
 ---------------------------------------
 - Embeds text using all-MiniLM-L6-v2 (only ~80MB)
-- Stores embeddings in a FAISS index (brain.index)
+- Stores embeddings in a FAISS HNSW index (brain.index), cosine similarity
 - Retrieves the 3 most relevant text chunks for any prompt
 - Also used by Layer 4 to store compressed long-term memories
 """
 
 import os
+import re
+import mmap
 import json
 import pickle
+import atexit
+import hashlib
+import tempfile
+import platform
+import functools
 import numpy as np
 import faiss
-from sentence_transformers import SentenceTransformer
+
+# Quiet HF tokenizers/transformers start-up chatter (and fork-related warm-up)
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+os.environ.setdefault("TRANSFORMERS_NO_ADVISORY_WARNINGS", "1")
 
 BRAIN_INDEX_FILE = "brain.index"
 BRAIN_META_FILE  = "brain_meta.pkl"
 KNOWLEDGE_DIR    = "knowledge_base"
 MODEL_NAME       = "all-MiniLM-L6-v2"
+# int8-quantized exports shipped with the model, tuned per CPU architecture
+if platform.machine().lower() in ("aarch64", "arm64"):
+    ONNX_MODEL_FILE = "onnx/model_qint8_arm64.onnx"
+else:
+    ONNX_MODEL_FILE = "onnx/model_quint8_avx2.onnx"
 EMBEDDING_DIM    = 384
 
+# HNSW graph parameters (approximate nearest-neighbour search)
+HNSW_M               = 32   # Neighbours per node
+HNSW_EF_CONSTRUCTION = 80   # Build-time search depth
+HNSW_EF_SEARCH       = 32   # Query-time search depth
+
+# Vectors are stored as float16 (half the bytes of float32, upcast during search).
+# Normalized embeddings are well within fp16 range, and unlike 8-bit quantization
+# there are no trained value ranges for later vectors to fall outside of.
+SQ_TYPE              = faiss.ScalarQuantizer.QT_fp16
+
+ENCODE_BATCH_SIZE    = 64
+QUERY_CACHE_SIZE     = 256  # Recent query embeddings kept in memory
+SAVE_EVERY           = 8    # Persist after this many memory additions (and on exit)
+
+_WORD_RE = re.compile(rb"\S+")
+
+def _text_digest(text: str) -> bytes:
+    """Compact 16-byte fingerprint of a chunk, used for duplicate detection."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
 class VectorBrain:
     def __init__(self):
         print("[Layer 2] Loading sentence embedding model...")
-        self.encoder = SentenceTransformer(MODEL_NAME)
+        self.encoder = self._load_encoder()
+        self._encode_query = functools.lru_cache(maxsize=QUERY_CACHE_SIZE)(self._encode_query_bytes)
         self.index = None
         self.metadata = []   # Stores the original text for each vector
+        self._seen = set()   # Digests of every stored text, for O(1) dedup
+        self._pending_saves = 0   # Additions not yet written to disk
         self._load_or_create_index()
         self._ingest_knowledge_base()
+        atexit.register(self.flush)
+
+    def _load_encoder(self):
+        """Prefer the int8 ONNX Runtime encoder; fall back to PyTorch if unavailable."""
+        # Imported here: sentence-transformers pulls in torch, which is slow to import
+        from sentence_transformers import SentenceTransformer
+        try:
+            encoder = SentenceTransformer(
+                MODEL_NAME,
+                backend="onnx",
+                model_kwargs={"file_name": ONNX_MODEL_FILE, "provider": "CPUExecutionProvider"}
+            )
+            print("[Layer 2] Using quantized ONNX encoder.")
+        except Exception as e:  # onnxruntime/optimum missing, or older sentence-transformers
+            print(f"[Layer 2] ONNX encoder unavailable ({e}), using PyTorch.")
+            import torch
+            torch.set_num_threads(os.cpu_count() or 1)
+            encoder = SentenceTransformer(MODEL_NAME)
+        if not getattr(encoder.tokenizer, "is_fast", False):
+            print("[Layer 2] Warning: slow Python tokenizer in use — install 'tokenizers' for faster ingestion.")
+        return encoder
 
     def _load_or_create_index(self):
         if os.path.exists(BRAIN_INDEX_FILE) and os.path.exists(BRAIN_META_FILE):
             self.index = faiss.read_index(BRAIN_INDEX_FILE)
             with open(BRAIN_META_FILE, "rb") as f:
-                self.metadata = pickle.load(f)
+                meta = pickle.load(f)
+            if isinstance(meta, dict):
+                self.metadata = meta["metadata"]
+                self._seen = meta["seen"]
+            else:
+                # Older brains pickled only the metadata list
+                self.metadata = meta
+                self._seen = {_text_digest(t) for t in self.metadata}
             print(f"[Layer 2] Loaded existing brain ({len(self.metadata)} chunks).")
+            if not self._index_is_current(self.index):
+                # Older brains used a different index layout — re-embed
+                self._rebuild_index()
+            elif self.index.ntotal != len(self.metadata):
+                # A crash between the two file swaps left them out of step — re-embed
+                self._rebuild_index()
+            self.index.hnsw.efSearch = HNSW_EF_SEARCH
         else:
-            self.index = faiss.IndexFlatL2(EMBEDDING_DIM)
+            self.index = self._new_index()
             self.metadata = []
+            self._seen = set()
             print("[Layer 2] Created new FAISS brain index.")
 
+    def _new_index(self):
+        """Empty HNSW index using inner product (cosine on normalized vectors)."""
+        index = faiss.IndexHNSWSQ(EMBEDDING_DIM, SQ_TYPE, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
+
+    def _index_is_current(self, index) -> bool:
+        """True if a loaded index has the layout _new_index() builds."""
+        if not isinstance(index, faiss.IndexHNSWSQ):
+            return False
+        storage = faiss.downcast_index(index.storage)
+        return storage.sq.qtype == SQ_TYPE and index.metric_type == faiss.METRIC_INNER_PRODUCT
+
+    def _rebuild_index(self):
+        """Re-embed all stored chunks into a fresh index."""
+        print(f"[Layer 2] Rebuilding brain index ({len(self.metadata)} chunks)...")
+        self.index = self._new_index()
+        if self.metadata:
+            self.index.add(self._encode(self.metadata))
+        self._save_index()
+
+    def _encode(self, texts: list) -> np.ndarray:
+        """
+        Embed texts as L2-normalized float32 vectors, in input order.
+        SentenceTransformer.encode already length-sorts texts before batching
+        (and restores the order afterwards), so batches carry little padding.
+        """
+        return self.encoder.encode(
+            texts,
+            batch_size=ENCODE_BATCH_SIZE,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        ).astype("float32")
+
+    def _encode_query_bytes(self, query: str) -> bytes:
+        """Embed a single query; wrapped in an LRU cache (bytes keep entries immutable)."""
+        return self._encode([query]).tobytes()
+
     def _save_index(self):
-        faiss.write_index(self.index, BRAIN_INDEX_FILE)
-        with open(BRAIN_META_FILE, "wb") as f:
-            pickle.dump(self.metadata, f)
+        # Write each file to a temp path and swap it in, so neither file is ever torn.
+        # The pair is not swapped atomically; a mismatch is caught and rebuilt on load.
+        index_dir = os.path.dirname(os.path.abspath(BRAIN_INDEX_FILE))
+        fd, tmp_index = tempfile.mkstemp(dir=index_dir, suffix=".tmp")
+        os.close(fd)
+        faiss.write_index(self.index, tmp_index)
+
+        meta_dir = os.path.dirname(os.path.abspath(BRAIN_META_FILE))
+        fd, tmp_meta = tempfile.mkstemp(dir=meta_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump({"metadata": self.metadata, "seen": self._seen}, f, protocol=5)
+
+        os.replace(tmp_index, BRAIN_INDEX_FILE)
+        os.replace(tmp_meta, BRAIN_META_FILE)
+        self._pending_saves = 0
+
+    def flush(self):
+        """Write pending additions to disk."""
+        if self._pending_saves:
+            self._save_index()
 
     def _ingest_knowledge_base(self):
         """Load all .txt files from knowledge_base/ folder into FAISS."""
@@ -51,20 +182,16 @@ class VectorBrain:
             os.makedirs(KNOWLEDGE_DIR)
             return
 
-        new_chunks = 0
+        pending = []
         for filename in sorted(os.listdir(KNOWLEDGE_DIR)):
             if not filename.endswith(".txt"):
                 continue
             filepath = os.path.join(KNOWLEDGE_DIR, filename)
-            with open(filepath, "r", encoding="utf-8") as f:
-                text = f.read()
 
             # Split into ~200 word chunks with overlap
-            chunks = self._chunk_text(text)
-            for chunk in chunks:
-                if chunk not in self.metadata:  # Avoid duplicates
-                    self.add(chunk)
-                    new_chunks += 1
+            pending.extend(self._chunk_file(filepath))
+
+        new_chunks = self.add_many(pending)  # Skips duplicates
 
         if new_chunks > 0:
             print(f"[Layer 2] Ingested {new_chunks} new chunks from knowledge_base/.")
@@ -72,36 +199,71 @@ class VectorBrain:
         else:
             print(f"[Layer 2] Knowledge base up to date ({len(self.metadata)} chunks total).")
 
-    def _chunk_text(self, text: str, chunk_size: int = 150, overlap: int = 20) -> list:
-        """Split text into overlapping word chunks."""
-        words = text.split()
-        chunks = []
-        start = 0
-        while start < len(words):
-            end = min(start + chunk_size, len(words))
-            chunk = " ".join(words[start:end])
-            chunks.append(chunk)
-            start += chunk_size - overlap
-        return chunks
+    def _chunk_file(self, filepath: str, chunk_size: int = 150, overlap: int = 20):
+        """
+        Yield overlapping word chunks of a file. The file is memory-mapped and
+        scanned word by word, so only the current window is held in memory.
+        """
+        if os.path.getsize(filepath) == 0:
+            return  # mmap cannot map an empty file
+        with open(filepath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            window = []
+            for match in _WORD_RE.finditer(mm):
+                window.append(match.group())
+                if len(window) == chunk_size:
+                    yield b" ".join(window).decode("utf-8", "replace")
+                    window = window[chunk_size - overlap:]
+            # Remaining chunk starts lie in the tail (which may be just the
+            # overlap of the last full chunk)
+            stride = chunk_size - overlap
+            while window:
+                yield b" ".join(window).decode("utf-8", "replace")
+                window = window[stride:]
 
     def add(self, text: str):
         """Add a text string to the FAISS index."""
-        embedding = self.encoder.encode([text], convert_to_numpy=True).astype("float32")
-        self.index = self.index if self.index else faiss.IndexFlatL2(EMBEDDING_DIM)
-        self.index.add(embedding)
-        self.metadata.append(text)
+        self.add_many([text])
+
+    def add_many(self, texts: list) -> int:
+        """
+        Add several text strings to the FAISS index in one encoder pass.
+        Texts already stored are skipped. Returns the number actually added.
+        """
+        new_texts = []
+        new_digests = set()
+        for text in texts:
+            digest = _text_digest(text)
+            if digest not in self._seen and digest not in new_digests:
+                new_digests.add(digest)
+                new_texts.append(text)
+        if not new_texts:
+            return 0
+
+        embeddings = self._encode(new_texts)
+        if self.index is None:
+            self.index = self._new_index()
+        self.index.add(embeddings)
+        self.metadata.extend(new_texts)
+        self._seen.update(new_digests)
+        return len(new_texts)
 
     def add_and_save(self, text: str):
-        """Add text and persist to disk (used by Layer 4 for memory compression)."""
+        """
+        Add text and schedule it for persistence (used by Layer 4 for memory
+        compression). Writes are coalesced: the brain is saved every SAVE_EVERY
+        additions, and any remainder is flushed at exit.
+        """
         self.add(text)
-        self._save_index()
+        self._pending_saves += 1
+        if self._pending_saves >= SAVE_EVERY:
+            self._save_index()
 
     def retrieve(self, query: str, top_k: int = 3) -> list:
         """Return the top_k most relevant text chunks for the query."""
         if self.index.ntotal == 0:
             return []
-        query_embedding = self.encoder.encode([query], convert_to_numpy=True).astype("float32")
-        distances, indices = self.index.search(query_embedding, min(top_k, self.index.ntotal))
+        query_embedding = np.frombuffer(self._encode_query(query), dtype="float32").reshape(1, -1)
+        scores, indices = self.index.search(query_embedding, min(top_k, self.index.ntotal))
         results = []
         for idx in indices[0]:
             if 0 <= idx < len(self.metadata):
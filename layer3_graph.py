@@ -8,13 +8,20 @@ LAYER 3: Concept Graph (NetworkX)
 
 import os
 import re
-import json
+import heapq
+import atexit
+import tempfile
+from itertools import combinations
+import orjson
 import networkx as nx
 
 GRAPH_FILE = "graph_data/concept_graph.json"
+LAYOUT_FILE = "graph_data/graph_layout.json"   # Node positions from the last /graph render
+VIZ_MAX_NODES = 100   # Only the most-mentioned nodes are drawn
+SAVE_EVERY = 10   # Persist the graph after this many updates (and on exit)
 
 # Common English stopwords to filter out
-STOPWORDS = {
+STOPWORDS = frozenset({
     "the", "a", "an", "is", "are", "was", "were", "be", "been", "being",
     "have", "has", "had", "do", "does", "did", "will", "would", "shall",
     "should", "may", "might", "can", "could", "to", "of", "in", "for",
@@ -27,33 +34,50 @@ STOPWORDS = {
     "when", "where", "why", "all", "each", "every", "any", "some",
     "write", "create", "make", "show", "tell", "give", "get", "use",
     "help", "want", "need", "like", "also", "just", "more", "very"
-}
+})
+
+# Words of 3+ chars starting with a letter (may contain _ + # . -, e.g. node.js)
+_KW_RE = re.compile(r'\b[a-zA-Z][a-zA-Z0-9_+#.-]{2,}\b')
+
+def _write_json_atomic(path: str, data):
+    """Write JSON to a temp file and swap it in, so a crash never leaves half a file."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY))
+    os.replace(tmp_path, path)
 
 class ConceptGraph:
     def __init__(self):
         self.graph = nx.Graph()
+        self._dirty = 0   # Updates not yet written to disk
+        self._last_pos = {}   # node -> [x, y] from the last visualization
         self._load_graph()
+        atexit.register(self.flush)
         print(f"[Layer 3] Concept graph loaded ({self.graph.number_of_nodes()} nodes, {self.graph.number_of_edges()} edges).")
 
     def _load_graph(self):
         os.makedirs("graph_data", exist_ok=True)
         if os.path.exists(GRAPH_FILE):
-            with open(GRAPH_FILE, "r") as f:
-                data = json.load(f)
+            with open(GRAPH_FILE, "rb") as f:
+                data = orjson.loads(f.read())
             self.graph = nx.node_link_graph(data)
+        if os.path.exists(LAYOUT_FILE):
+            with open(LAYOUT_FILE, "rb") as f:
+                self._last_pos = orjson.loads(f.read())
 
     def _save_graph(self):
-        data = nx.node_link_data(self.graph)
-        with open(GRAPH_FILE, "w") as f:
-            json.dump(data, f)
+        _write_json_atomic(GRAPH_FILE, nx.node_link_data(self.graph))
+        self._dirty = 0
+
+    def flush(self):
+        """Write pending graph updates to disk."""
+        if self._dirty:
+            self._save_graph()
 
     def _extract_keywords(self, text: str) -> list:
         """Extract meaningful words from text (basic NLP without heavy deps)."""
-        # Lowercase and extract words
-        words = re.findall(r'\b[a-zA-Z][a-zA-Z0-9_+#.-]{2,}\b', text.lower())
-        # Filter stopwords and keep meaningful terms
-        keywords = [w for w in words if w not in STOPWORDS]
-        return list(set(keywords))  # Deduplicate
+        # Lowercase, extract words, drop stopwords and deduplicate in one pass
+        return list({w for w in _KW_RE.findall(text.lower()) if w not in STOPWORDS})
 
     def update(self, text: str):
         """Extract concepts from text and update the graph."""
@@ -66,16 +90,18 @@ class ConceptGraph:
             else:
                 self.graph.nodes[kw]["mentions"] = self.graph.nodes[kw].get("mentions", 0) + 1
 
-        # Add/strengthen edges for co-mentioned keywords
-        for i, kw1 in enumerate(keywords):
-            for kw2 in keywords[i+1:]:
-                if kw1 != kw2:
-                    if self.graph.has_edge(kw1, kw2):
-                        self.graph[kw1][kw2]["weight"] += 1
-                    else:
-                        self.graph.add_edge(kw1, kw2, weight=1)
+        # Add/strengthen edges for co-mentioned keywords (keywords are unique)
+        adj = self.graph.adj
+        for kw1, kw2 in combinations(keywords, 2):
+            edge = adj[kw1].get(kw2)
+            if edge is not None:
+                edge["weight"] = edge.get("weight", 0) + 1
+            else:
+                self.graph.add_edge(kw1, kw2, weight=1)
 
-        self._save_graph()
+        self._dirty += 1
+        if self._dirty >= SAVE_EVERY:
+            self._save_graph()
 
     def retrieve(self, query: str, top_k: int = 3) -> list:
         """Given a query, find the top related concepts from the graph."""
@@ -102,17 +128,32 @@ class ConceptGraph:
                 return
 
             plt.figure(figsize=(12, 8))
-            pos = nx.spring_layout(self.graph, k=2, seed=42)
+
+            # Draw only the most-mentioned nodes so render time stays bounded
+            if self.graph.number_of_nodes() > VIZ_MAX_NODES:
+                top = heapq.nlargest(VIZ_MAX_NODES, self.graph.nodes(),
+                                     key=lambda n: self.graph.nodes[n].get("mentions", 1))
+                graph = self.graph.subgraph(top)
+            else:
+                graph = self.graph
+
+            # Start from the previous layout so a few iterations are enough;
+            # new nodes get random starting positions
+            prev = {n: self._last_pos[n] for n in graph if n in self._last_pos}
+            pos = nx.spring_layout(graph, k=2, seed=42, pos=prev or None,
+                                   iterations=20 if prev else 50)
+            self._last_pos.update({n: [float(x), float(y)] for n, (x, y) in pos.items()})
+            _write_json_atomic(LAYOUT_FILE, self._last_pos)
             
             # Node sizes by mention count
-            sizes = [self.graph.nodes[n].get("mentions", 1) * 200 for n in self.graph.nodes()]
+            sizes = [graph.nodes[n].get("mentions", 1) * 200 for n in graph.nodes()]
             
             # Edge widths by weight
-            weights = [self.graph[u][v].get("weight", 1) for u, v in self.graph.edges()]
+            weights = [graph[u][v].get("weight", 1) for u, v in graph.edges()]
             
-            nx.draw_networkx_nodes(self.graph, pos, node_size=sizes, node_color="#4A90D9", alpha=0.8)
-            nx.draw_networkx_labels(self.graph, pos, font_size=9, font_color="white", font_weight="bold")
-            nx.draw_networkx_edges(self.graph, pos, width=weights, alpha=0.5, edge_color="#888")
+            nx.draw_networkx_nodes(graph, pos, node_size=sizes, node_color="#4A90D9", alpha=0.8)
+            nx.draw_networkx_labels(graph, pos, font_size=9, font_color="white", font_weight="bold")
+            nx.draw_networkx_edges(graph, pos, width=weights, alpha=0.5, edge_color="#888")
             
             plt.title("MSCP Concept Graph", fontsize=16, fontweight="bold")
             plt.axis("off")
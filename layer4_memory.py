@@ -8,8 +8,10 @@ LAYER 4: Short-Term Memory Buffer
 """
 
 from collections import deque
+from layer5_assembler import pack_chunks, truncate_to_tokens, HISTORY_TOKEN_BUDGET
 
 MAX_BUFFER = 5
+MAX_MEMORY_TOKENS = 200   # Cap on a stored memory, well inside Layer 5's knowledge budget
 
 class ShortTermBuffer:
     def __init__(self, vector_brain):
@@ -36,7 +38,9 @@ class ShortTermBuffer:
         """
         role = message["role"]
         content = message["content"]
-        memory = f"[PAST MEMORY - {role.upper()}]: {content[:300]}"  # Truncate for brevity
+        memory = f"[PAST MEMORY - {role.upper()}]: {content}"
+        # Capped so a retrieved memory can always be packed into the prompt
+        memory = truncate_to_tokens(memory, MAX_MEMORY_TOKENS)
         self.vector_brain.add_and_save(memory)
         self.overflow_count += 1
 
@@ -44,15 +48,17 @@ class ShortTermBuffer:
         """Return the current buffer as a list of dicts."""
         return list(self.buffer)
 
-    def format_for_prompt(self) -> str:
-        """Format the chat history as a readable string block."""
+    def format_for_prompt(self, budget_tokens: int = HISTORY_TOKEN_BUDGET, tokenize=None) -> str:
+        """
+        Format the chat history as a readable string block, keeping the most
+        recent messages that fit in budget_tokens (see layer5_assembler.pack_chunks).
+        The window stays contiguous: the oldest message kept may be truncated.
+        """
         if not self.buffer:
             return "No previous messages."
-        lines = []
-        for msg in self.buffer:
-            role = msg["role"].capitalize()
-            content = msg["content"][:200]  # Trim long messages
-            lines.append(f"{role}: {content}")
+        lines = [f"{msg['role'].capitalize()}: {msg['content']}" for msg in self.buffer]
+        # Pack newest-first so recent turns win, then restore chronological order
+        lines = pack_chunks(reversed(lines), budget_tokens, tokenize, contiguous=True)[::-1]
         return "\n".join(lines)
 
     def clear(self):
@@ -14,21 +14,40 @@ Answer questions directly in plain text. Do NOT write Python code unless the use
 Use the RETRIEVED KNOWLEDGE below to answer factual questions accurately.
 If the knowledge contains the answer, use it. Be concise and direct."""
 
-def assemble_prompt(
+# Token budgets for per-turn context (prefill cost grows with prompt length)
+KNOWLEDGE_TOKEN_BUDGET = 800
+HISTORY_TOKEN_BUDGET   = 400
+
+# Static prompt pieces — identical every turn. The system prefix ends either at
+# <|eot_id|> or after the "\n\n" separator, both of which are tokenizer
+# boundaries, so pieces tokenized separately match the joined prompt.
+SYSTEM_PREFIX = f"<|start_header_id|>system<|end_header_id|>\n\n{SYSTEM_PERSONA}"
+SYSTEM_TURN = f"{SYSTEM_PREFIX}<|eot_id|>"
+SYSTEM_PREFIX_SEP = f"{SYSTEM_PREFIX}\n\n"
+USER_TURN_TMPL = "<|start_header_id|>user<|end_header_id|>\n\n{}<|eot_id|>"
+ASSISTANT_HEADER = "<|start_header_id|>assistant<|end_header_id|>\n\n"
+
+def assemble_prompt_parts(
     user_input: str,
     graph_concepts: list,
     faiss_chunks: list,
     chat_history: str,
-    temperature_hint: float = 0.2
-) -> str:
+    temperature_hint: float = 0.2,
+    max_context_tokens: int = KNOWLEDGE_TOKEN_BUDGET,
+    tokenize=None
+) -> list:
     """
-    Assemble the full prompt from all 5 layers.
+    Assemble the full prompt from all 5 layers, as a list of pieces:
+    [persona system prefix (static), per-turn context + user turn (dynamic),
+    assistant header (static)]. Pieces are split at tokenizer boundaries, so
+    Layer 1 can tokenize them separately and cache the static ones.
 
     IMPORTANT: No <|begin_of_text|> here — llama.cpp adds it automatically.
     Including it causes duplicate token warning and completely breaks the model output.
     """
 
-    # --- Format FAISS chunks (full text, not truncated) ---
+    # --- Format FAISS chunks (whole chunks, packed into the token budget) ---
+    faiss_chunks = pack_chunks(faiss_chunks, max_context_tokens, tokenize)
     if faiss_chunks:
         knowledge_block = "\n\n".join(f"[FACT {i+1}]: {chunk}" for i, chunk in enumerate(faiss_chunks))
         knowledge_section = f"RETRIEVED KNOWLEDGE:\n{knowledge_block}"
@@ -47,31 +66,89 @@ def assemble_prompt(
     else:
         history_section = ""
 
-    # --- Build ONE system block ---
-    system_parts = [SYSTEM_PERSONA]
+    # --- Build ONE system block: persona, then the per-turn context ---
+    context_parts = []
     if knowledge_section:
-        system_parts.append(knowledge_section)
+        context_parts.append(knowledge_section)
     if concept_section:
-        system_parts.append(concept_section)
+        context_parts.append(concept_section)
     if history_section:
-        system_parts.append(history_section)
+        context_parts.append(history_section)
 
-    system_block = "\n\n".join(system_parts)
+    user_turn = USER_TURN_TMPL.format(user_input)
 
     # --- Llama 3.2 instruct format — NO <|begin_of_text|> ---
-    prompt = (
-        f"<|start_header_id|>system<|end_header_id|>\n\n"
-        f"{system_block}"
-        f"<|eot_id|>"
-        f"<|start_header_id|>user<|end_header_id|>\n\n"
-        f"{user_input}"
-        f"<|eot_id|>"
-        f"<|start_header_id|>assistant<|end_header_id|>\n\n"
-    )
+    if context_parts:
+        dynamic = "\n\n".join(context_parts) + "<|eot_id|>" + user_turn
+        return [SYSTEM_PREFIX_SEP, dynamic, ASSISTANT_HEADER]
+    return [SYSTEM_TURN, user_turn, ASSISTANT_HEADER]
+
 
-    return prompt
+def assemble_prompt(
+    user_input: str,
+    graph_concepts: list,
+    faiss_chunks: list,
+    chat_history: str,
+    temperature_hint: float = 0.2,
+    max_context_tokens: int = KNOWLEDGE_TOKEN_BUDGET,
+    tokenize=None
+) -> str:
+    """Assemble the full prompt from all 5 layers as a single string."""
+    return "".join(assemble_prompt_parts(
+        user_input, graph_concepts, faiss_chunks, chat_history, temperature_hint,
+        max_context_tokens, tokenize
+    ))
 
 
 def count_tokens_approx(text: str) -> int:
     """Rough token estimate: ~4 chars per token."""
     return len(text) // 4
+
+
+def _count_tokens(text: str, tokenize=None) -> int:
+    return len(tokenize(text)) if tokenize else count_tokens_approx(text)
+
+
+def truncate_to_tokens(text: str, budget_tokens: int, tokenize=None) -> str:
+    """Cut text down to its longest prefix that fits in budget_tokens."""
+    n = _count_tokens(text, tokenize)
+    if n <= budget_tokens:
+        return text
+    if budget_tokens <= 0:
+        return ""
+    # Proportional first guess, then shrink until it fits
+    cut = len(text) * budget_tokens // n
+    while cut > 0 and _count_tokens(text[:cut], tokenize) > budget_tokens:
+        cut = cut * 9 // 10
+    return text[:cut]
+
+
+def pack_chunks(chunks, budget_tokens: int, tokenize=None, contiguous: bool = False) -> list:
+    """
+    Greedily keep chunks, in order, while their total size fits in budget_tokens.
+    `tokenize` maps text to a token sequence (e.g. LLMEngine.tokenize_cached);
+    without it sizes are estimated.
+
+    By default chunks that would overflow the budget are skipped. With
+    contiguous=True (chat history) packing stops at the first such chunk
+    instead, after truncating it into whatever budget remains.
+    """
+    packed = []
+    used = 0
+    for chunk in chunks:
+        n = _count_tokens(chunk, tokenize)
+        if used + n > budget_tokens:
+            if not contiguous:
+                continue
+            truncated = truncate_to_tokens(chunk, budget_tokens - used, tokenize)
+            if truncated:
+                packed.append(truncated)
+            break
+        packed.append(chunk)
+        used += n
+    return packed
+
+
+# Guard against the double-BOS regression described above
+assert "<|begin_of_text|>" not in assemble_prompt("x", [], [], ""), \
+    "Prompt must not contain <|begin_of_text|> — llama.cpp adds BOS itself"
@@ -18,6 +18,9 @@ Commands:
 
 import sys
 import os
+from concurrent.futures import ThreadPoolExecutor
+
+STREAM_FLUSH_TOKENS = 8   # Max streamed tokens buffered before writing to the terminal
 
 try:
     from colorama import Fore, Style, init
@@ -26,6 +29,35 @@ try:
 except ImportError:
     HAS_COLOR = False
 
+class _Lazy:
+    """
+    Builds an object on first use, so heavy models load only when needed.
+    Attribute access is forwarded, so it can stand in for the object itself.
+    """
+    def __init__(self, factory):
+        self._factory = factory
+        self._value = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._value is not None
+
+    def get(self):
+        if self._value is None:
+            self._value = self._factory()
+        return self._value
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+def _load_vector_brain():
+    from layer2_vector import VectorBrain
+    return VectorBrain()
+
+def _load_llm():
+    from layer1_engine import LLMEngine
+    return LLMEngine()
+
 def color(text, c=""):
     if HAS_COLOR:
         return c + text + Style.RESET_ALL
@@ -66,9 +98,8 @@ def main():
     # ── Initialize all layers ──────────────────────────────────
     print(color("[MSCP] Initializing layers...\n", Fore.YELLOW if HAS_COLOR else ""))
 
-    # Layer 2: Vector Brain (must init first, others depend on it)
-    from layer2_vector import VectorBrain
-    vector_brain = VectorBrain()
+    # Layer 2: Vector Brain (loads MiniLM + FAISS on the first message)
+    vector_brain = _Lazy(_load_vector_brain)
 
     # Layer 3: Concept Graph
     from layer3_graph import ConceptGraph
@@ -79,15 +110,18 @@ def main():
     memory_buffer = ShortTermBuffer(vector_brain)
 
     # Layer 5: Prompt Assembler (stateless functions, no init needed)
-    from layer5_assembler import assemble_prompt, count_tokens_approx
+    from layer5_assembler import assemble_prompt_parts
 
-    # Layer 1: LLM Engine (loads the model — takes a moment)
-    from layer1_engine import LLMEngine
-    llm = LLMEngine()
+    # Layer 1: LLM Engine (loads the model on the first message — takes a moment)
+    llm = _Lazy(_load_llm)
 
-    print(color("\n[MSCP] All systems online. Ready!\n", Fore.GREEN if HAS_COLOR else ""))
+    print(color("\n[MSCP] Ready! Models load on your first message.\n", Fore.GREEN if HAS_COLOR else ""))
     print("-" * 60)
 
+    # Worker threads for Layer 2/3 work that can overlap (encoders release the GIL)
+    executor = ThreadPoolExecutor(max_workers=2)
+    pending_graph_update = None   # Graph update from the previous turn, still running
+
     # ── Main Loop ─────────────────────────────────────────────
     while True:
         try:
@@ -102,6 +136,11 @@ def main():
         if not user_input:
             continue
 
+        # The concept graph must be settled before anything reads or saves it
+        if pending_graph_update is not None:
+            pending_graph_update.result()
+            pending_graph_update = None
+
         # ── Handle commands ────────────────────────────────────
         if user_input.startswith("/"):
             cmd = user_input.lower().split()[0]
@@ -127,7 +166,10 @@ def main():
 
             elif cmd == "/ingest":
                 print("[Layer 2] Re-ingesting knowledge_base/ ...")
-                vector_brain._ingest_knowledge_base()
+                if vector_brain.loaded:
+                    vector_brain._ingest_knowledge_base()
+                else:
+                    vector_brain.get()  # Loading the brain ingests the knowledge base
 
             else:
                 print(f"Unknown command: {user_input}. Type /help for commands.")
@@ -135,36 +177,45 @@ def main():
 
         # ── Process normal user message ────────────────────────
 
+        # Load the heavy layers here, on the main thread, before any worker uses them
+        vector_brain.get()
+        try:
+            llm.get()
+        except FileNotFoundError as e:
+            print(f"[Layer 1] {e}")
+            continue
+
         # Step 1: Update memory buffer with user message
         memory_buffer.add("user", user_input)
 
-        # Step 2: Layer 3 — Get related concepts from graph
-        graph_concepts = concept_graph.retrieve(user_input)
-
-        # Step 3: Layer 2 — Retrieve relevant FAISS chunks
-        faiss_chunks = vector_brain.retrieve(user_input, top_k=5)
+        # Steps 2+3: Layer 3 (related concepts) and Layer 2 (FAISS chunks) in parallel
+        f_graph = executor.submit(concept_graph.retrieve, user_input)
+        f_faiss = executor.submit(vector_brain.retrieve, user_input, 5)
+        graph_concepts = f_graph.result()
+        faiss_chunks = f_faiss.result()
 
         # Step 4: Layer 4 — Get formatted chat history
-        chat_history = memory_buffer.format_for_prompt()
+        chat_history = memory_buffer.format_for_prompt(tokenize=llm.tokenize_cached)
 
-        # Step 5: Layer 5 — Assemble the full prompt
-        prompt = assemble_prompt(
+        # Step 5: Layer 5 — Assemble the full prompt (as cacheable pieces)
+        prompt_parts = assemble_prompt_parts(
             user_input=user_input,
             graph_concepts=graph_concepts,
             faiss_chunks=faiss_chunks,
             chat_history=chat_history,
-            temperature_hint=0.2
+            temperature_hint=0.2,
+            tokenize=llm.tokenize_cached
         )
 
         # Show a small debug hint (optional)
-        token_estimate = count_tokens_approx(prompt)
+        token_count = llm.count_tokens(prompt_parts)
         if HAS_COLOR:
-            print(Fore.YELLOW + f"[↑ Ctx: ~{token_estimate} tokens | Graph: {graph_concepts} | FAISS: {len(faiss_chunks)} chunks]" + Style.RESET_ALL)
+            print(Fore.YELLOW + f"[↑ Ctx: {token_count} tokens | Graph: {graph_concepts} | FAISS: {len(faiss_chunks)} chunks]" + Style.RESET_ALL)
         else:
-            print(f"[Ctx: ~{token_estimate} tokens | Graph: {graph_concepts} | FAISS: {len(faiss_chunks)} chunks]")
+            print(f"[Ctx: {token_count} tokens | Graph: {graph_concepts} | FAISS: {len(faiss_chunks)} chunks]")
 
-        # Step 6: Layer 3 — Update graph with new input
-        concept_graph.update(user_input)
+        # Step 6: Layer 3 — Update graph with new input (overlaps with LLM streaming)
+        pending_graph_update = executor.submit(concept_graph.update, user_input)
 
         # Step 7: Layer 1 — Stream the LLM response
         if HAS_COLOR:
@@ -172,13 +223,24 @@ def main():
         else:
             print("\nAssistant: ", end="", flush=True)
 
-        full_response = ""
+        response_tokens = []
+        pending = []   # Tokens not yet written to the terminal
         try:
-            for token in llm.generate(prompt, max_tokens=512, temperature=0.2, stream=True):
-                print(token, end="", flush=True)
-                full_response += token
+            for token in llm.generate_from_parts(prompt_parts, max_tokens=512, temperature=0.2, stream=True):
+                response_tokens.append(token)
+                pending.append(token)
+                # Flush in small batches, or right away at sentence/line boundaries
+                if len(pending) >= STREAM_FLUSH_TOKENS or token.endswith((".", "!", "?", "\n")):
+                    sys.stdout.write("".join(pending))
+                    sys.stdout.flush()
+                    pending.clear()
         except Exception as e:
+            sys.stdout.write("".join(pending))
+            pending.clear()
             print(f"\n[Layer 1 Error] {e}")
+        sys.stdout.write("".join(pending))
+        sys.stdout.flush()
+        full_response = "".join(response_tokens)
 
         print()  # Newline after streamed response
 
@@ -188,6 +250,8 @@ def main():
 
         print("-" * 60)
 
+    executor.shutdown(wait=True)
+
 
 if __name__ == "__main__":
     main()
@@ -18,13 +18,19 @@ echo "[Phase 1] Installing core dependencies..."
 pip install --upgrade pip -q
 
 echo "  → Installing llama-cpp-python (CPU only)..."
-pip install llama-cpp-python -q
+if [ "$(uname -m)" = "aarch64" ] || [ "$(uname -m)" = "arm64" ]; then
+    # Build for this CPU with int8 dot-product (sdot) kernels enabled
+    CMAKE_ARGS="-DGGML_NATIVE=ON -DGGML_CPU_ARM_ARCH=armv8.2-a+dotprod" \
+        pip install llama-cpp-python --no-binary llama-cpp-python -q
+else
+    pip install llama-cpp-python -q
+fi
 
 echo "  → Installing FAISS + sentence-transformers..."
-pip install faiss-cpu sentence-transformers -q
+pip install faiss-cpu "sentence-transformers[onnx]" -q
 
-echo "  → Installing NetworkX + matplotlib..."
-pip install networkx matplotlib -q
+echo "  → Installing NetworkX + orjson + matplotlib..."
+pip install networkx orjson matplotlib -q
 
 echo "  → Installing other utilities..."
 pip install huggingface_hub tqdm colorama -q